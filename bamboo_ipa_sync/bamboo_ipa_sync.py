@@ -12,6 +12,7 @@ Copyright (C) 2018 WANdisco
 
 from __future__ import print_function
 from .__version__ import __version__
+from .freeipadirectory import FreeIPADirectory
 
 from pplogger import get_logger
 from ppipa import FreeIPAServer
@@ -88,17 +89,24 @@ class Main(object):
             exit(1)
 
         self._bamboo = BambooHR(self._bamboo_url, self._bamboo_api_key)
-        self._ldap = FreeIPAServer(host=self._ipa_server, bindpw=self._bind_pw)
+        self._ldap_server = None
+        self._directory = FreeIPADirectory(host=self._ipa_server, bindpw=self._bind_pw)
 
         try:
             getattr(self, args.command.replace('-', '_'))()
         except ImportError:
             print('Command %s not implemented' % args.command)
 
+    @property
+    def _ldap(self):
+        if not self._ldap_server:
+            self._ldap_server = FreeIPAServer(host=self._ipa_server, bindpw=self._bind_pw)
+        return self._ldap_server
+
     def check_ipa(self):
         log.debug('Checking FreeIPA directory for accounts missing in BambooHR')
         missing = []
-        for uid, user in self._ldap.users().items():
+        for _, uid, user in self._directory.stream():
             bamboo_accounts = []
             for email in user.mail:
                 ids = self._bamboo.find_accounts_by_email(email)
@@ -113,7 +121,7 @@ class Main(object):
             table = prettytable.PrettyTable(['#', 'uid', 'givenName', 'sn', 'mail'], sortby='uid')
             table.align = 'l'
             for uid in sorted(missing):
-                ldap_user = self._ldap.users()[uid]
+                ldap_user = self._directory.users()[uid]
                 table.add_row([i, uid, ldap_user.given_name if ldap_user.given_name else '',
                                ldap_user.sn if ldap_user.sn else '', ', '.join(ldap_user.mail)])
                 i += 1
@@ -123,7 +131,7 @@ class Main(object):
         log.debug('Checking BambooHR directory for accounts missing in FreeIPA')
         missing = []
         for bamboo_id, bamboo_fields in self._bamboo.get_directory().items():
-            ldap_accounts = self._ldap.find_users_by_email(bamboo_fields.get('workEmail'))
+            ldap_accounts = self._directory.find_users_by_email(bamboo_fields.get('workEmail'))
             n = len(ldap_accounts)
             if n == 0:
                 missing.append(bamboo_id)
@@ -154,14 +162,14 @@ class Main(object):
                     args.key.lower() in bamboo_fields.get('preferredName').lower() or \
                     args.key.lower() in bamboo_fields.get('mobilePhone').lower() or \
                     args.key.lower() in bamboo_fields.get('division').lower():
-                ldap_user = self._ldap.find_users_by_email(bamboo_fields.get('workEmail'))
+                ldap_user = self._directory.find_users_by_email(bamboo_fields.get('workEmail'))
                 if ldap_user:
                     ldap_user = ldap_user[0]
                     ldap_uids.append(ldap_user.uid)
-                self._print_table(i=i, bamboo_id=bamboo_id, uid=ldap_user.uid if ldap_user else None)
+                self._print_table(i=i, bamboo_id=bamboo_id, ldap_user=ldap_user or None)
                 i += 1
 
-        for uid, ldap_user in self._ldap.users().items():
+        for _, uid, ldap_user in self._directory.stream():
             if uid in ldap_uids:
                 continue
             if args.key.lower() in uid or \
@@ -171,10 +179,10 @@ class Main(object):
                     args.key.lower() in (ldap_user.title or '') or \
                     args.key.lower() in ', '.join(ldap_user.telephone_number) or \
                     args.key.lower() in ', '.join(ldap_user.mail):
-                self._print_table(i=i, uid=uid)
+                self._print_table(i=i, ldap_user=ldap_user)
                 i += 1
 
-    def _print_table(self, i, bamboo_id=None, uid=None):
+    def _print_table(self, i, bamboo_id=None, ldap_user=None):
         header = ['#%s' % i]
 
         if bamboo_id:
@@ -183,11 +191,8 @@ class Main(object):
         else:
             bamboo_fields = None
 
-        if uid:
-            ldap_user = self._ldap.users()[uid]
+        if ldap_user:
             header.append('FreeIPA')
-        else:
-            ldap_user = None
 
         table = prettytable.PrettyTable(header)
         table.align = 'l'
@@ -195,21 +200,21 @@ class Main(object):
         row = ['UID']
         if bamboo_id:
             row.append(bamboo_id)
-        if uid:
+        if ldap_user:
             row.append(ldap_user.uid)
         table.add_row(row)
 
         row = ['First']
         if bamboo_id:
             row.append(bamboo_fields.get('firstName'))
-        if uid:
+        if ldap_user:
             row.append(ldap_user.given_name or '')
         table.add_row(row)
 
         row = ['Last']
         if bamboo_id:
             row.append(bamboo_fields.get('lastName'))
-        if uid:
+        if ldap_user:
             row.append(ldap_user.sn or '')
         table.add_row(row)
 
@@ -220,35 +225,35 @@ class Main(object):
         row = ['Department']
         if bamboo_id:
             row.append(bamboo_fields.get('department'))
-        if uid:
+        if ldap_user:
             row.append(ldap_user.department_number or '')
         table.add_row(row)
 
         row = ['Job title']
         if bamboo_id:
             row.append(bamboo_fields.get('jobTitle'))
-        if uid:
+        if ldap_user:
             row.append(ldap_user.title or '')
         table.add_row(row)
 
         row = ['Mobile']
         if bamboo_id:
             row.append(bamboo_fields.get('mobilePhone'))
-        if uid:
+        if ldap_user:
             row.append(', '.join(ldap_user.telephone_number))
         table.add_row(row)
 
         row = ['Email']
         if bamboo_id:
             row.append(bamboo_fields.get('workEmail'))
-        if uid:
+        if ldap_user:
             row.append(', '.join(ldap_user.mail))
         table.add_row(row)
 
         row = ['Division']
         if bamboo_id:
             row.append(bamboo_fields.get('division'))
-        if uid:
+        if ldap_user:
             row.append(ldap_user.ou or '')
         table.add_row(row)
 
@@ -276,7 +281,7 @@ class Main(object):
         table = prettytable.PrettyTable(['ID', 'First', 'Last', 'EMail', 'Department', 'Job title', 'Division', 'UID'],
                                         sortby='Last')
         table.align = 'l'
-        for uid, user in self._ldap.users().items():
+        for _, uid, user in self._directory.stream():
             table.add_row([
                 user.employee_number if user.employee_number else '',
                 user.given_name if user.given_name else '',
@@ -304,6 +309,7 @@ class Main(object):
 
         mailer = Mailer()
         directory = self._bamboo.get_directory()
+        self._directory.load()
         local_tz = tzlocal.get_localzone()
         now = local_tz.localize(datetime.datetime.now()).date()
 
@@ -331,7 +337,7 @@ class Main(object):
             pref_first_name = self._capitalize(pref_first_name)
             pref_last_name = self._capitalize(pref_last_name)
 
-            result = self._ldap.find_users_by_email(email=bamboo_email)
+            result = self._directory.find_users_by_email(email=bamboo_email)
 
             if len(result) == 0:
                 fields = self._bamboo.fetch_field(bamboo_id, [
@@ -350,11 +356,11 @@ class Main(object):
                     'customSystems'
                 ])
 
-                if self._ldap.users().get(bamboo_email_uid):
+                if self._directory.users().get(bamboo_email_uid):
                     exists = 'Active'
-                elif self._ldap.users(user_base='stage').get(bamboo_email_uid):
+                elif self._directory.users(user_base='stage').get(bamboo_email_uid):
                     exists = 'Stage'
-                elif self._ldap.users(user_base='preserved').get(bamboo_email_uid):
+                elif self._directory.users(user_base='preserved').get(bamboo_email_uid):
                     exists = 'Preserved'
                 else:
                     exists = False
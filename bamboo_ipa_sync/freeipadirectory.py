@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""FreeIPA Directory Class
+
+Read-only view of FreeIPA user containers. Each container is retrieved with
+paged-results searches over its own pooled connection, so active, stage and
+preserved users are fetched concurrently and entries can be consumed as pages
+arrive instead of after the whole subtree has been returned.
+
+Author: Peter Pakos <peter.pakos@wandisco.com>
+
+Copyright (C) 2018 WANdisco
+"""
+
+from __future__ import print_function
+from ppipa import FreeIPAUser
+
+import logging
+import threading
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+log = logging.getLogger(__name__)
+
+
+class FreeIPADirectory(object):
+    """Define FreeIPA directory object"""
+    _containers = {
+        'active': 'cn=users,cn=accounts,',
+        'stage': 'cn=staged users,cn=accounts,cn=provisioning,',
+        'preserved': 'cn=deleted users,cn=accounts,cn=provisioning,'
+    }
+
+    def __init__(self, host, binddn='cn=Directory Manager', bindpw='', timeout=5, tls=True, page_size=500):
+        """Initialise object"""
+        log.debug('Initialising FreeIPA directory %s' % host)
+        self._host = host
+        self._binddn = binddn
+        self._bindpw = bindpw
+        self._timeout = timeout
+        self._tls = tls
+        self._page_size = page_size
+        self._url = 'ldaps://' + host if self._tls else 'ldap://' + host
+        if self._tls:
+            ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
+        self._pool = queue.Queue()
+        self._base_dn = None
+        self._users = dict((user_base, {}) for user_base in self._containers)
+        self._emails = dict((user_base, {}) for user_base in self._containers)
+        self._loaded = set()
+        self._fetching = set()
+
+    def __repr__(self):
+        """String representation of the object"""
+        return 'FreeIPADirectory(%r)' % self._host
+
+    def _connect(self):
+        """Establish new connection to the server"""
+        conn = ldap.initialize(self._url)
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self._timeout)
+        conn.set_option(ldap.OPT_REFERRALS, 0)
+        conn.simple_bind_s(self._binddn, self._bindpw)
+        log.debug('%s connection established' % ('LDAPS' if self._tls else 'LDAP'))
+        return conn
+
+    def _acquire(self):
+        """Take connection from the pool, open a new one if none is idle"""
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    def _release(self, conn):
+        """Return connection to the pool"""
+        self._pool.put(conn)
+
+    @staticmethod
+    def _discard(conn):
+        """Close connection that must not be reused"""
+        try:
+            conn.unbind_s()
+        except Exception:
+            pass
+
+    def _get_base_dn(self):
+        """Get Base DN from LDAP"""
+        if not self._base_dn:
+            conn = self._acquire()
+            released = False
+            try:
+                results = conn.search_s('cn=config', ldap.SCOPE_BASE, '(objectClass=*)',
+                                        ['nsslapd-defaultnamingcontext'])
+                self._release(conn)
+                released = True
+            finally:
+                if not released:
+                    self._discard(conn)
+            _, attrs = results[0]
+            self._base_dn = attrs['nsslapd-defaultnamingcontext'][0].decode('utf-8')
+            log.debug('Base DN: %s' % self._base_dn)
+        return self._base_dn
+
+    def _paged_search(self, conn, base, fltr, attrs=None, scope=ldap.SCOPE_ONELEVEL):
+        """Perform paged LDAP search, yield one page of results at a time"""
+        ctrl = SimplePagedResultsControl(True, size=self._page_size, cookie='')
+        while True:
+            msgid = conn.search_ext(base, scope, fltr, attrs, serverctrls=[ctrl])
+            _, rdata, _, serverctrls = conn.result3(msgid)
+            yield rdata
+            cookie = None
+            for sctrl in serverctrls:
+                if sctrl.controlType == SimplePagedResultsControl.controlType:
+                    cookie = sctrl.cookie
+                    break
+            if not cookie:
+                break
+            ctrl.cookie = cookie
+
+    @staticmethod
+    def _put(pages, item, cancel):
+        """Put item on the queue unless the consumer has gone away, return True if queued"""
+        while not cancel.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _fetch(self, user_base, base, pages, cancel):
+        """Fetch container over a pooled connection and push its pages to the queue
+
+        Always ends with exactly one (user_base, None, error) item unless cancelled; only connections
+        that completed their search go back to the pool.
+        """
+        conn = None
+        error = None
+        done = False
+        try:
+            conn = self._acquire()
+            for page in self._paged_search(conn, base, '(objectClass=*)', ['*']):
+                if not self._put(pages, (user_base, page, None), cancel):
+                    break
+            else:
+                done = True
+        except Exception as e:
+            error = e
+        finally:
+            if conn is not None:
+                if done:
+                    self._release(conn)
+                else:
+                    self._discard(conn)
+            self._put(pages, (user_base, None, error), cancel)
+
+    def _add_user(self, user_base, dn, attrs):
+        """Index user by uid and email address, return None if uid is already indexed"""
+        uid = attrs.get('uid')[0].decode('utf-8', 'ignore')
+        if uid in self._users[user_base]:
+            return None
+        user = FreeIPAUser(dn, attrs)
+        self._users[user_base][uid] = user
+        for mail in user.mail:
+            self._emails[user_base].setdefault(mail.lower(), []).append(user)
+        return uid, user
+
+    def stream(self, user_bases=('active',)):
+        """Yield (user_base, uid, user) tuples as entries arrive from LDAP
+
+        Containers already being fetched by another stream are served from the users received so far.
+        """
+        for user_base in user_bases:
+            if user_base in self._loaded or user_base in self._fetching:
+                for uid, user in list(self._users[user_base].items()):
+                    yield user_base, uid, user
+
+        pending = [user_base for user_base in user_bases
+                   if user_base not in self._loaded and user_base not in self._fetching]
+        if not pending:
+            return
+
+        base_dn = self._get_base_dn()
+        pages = queue.Queue(maxsize=len(pending) * 2)
+        cancel = threading.Event()
+        for user_base in pending:
+            self._users[user_base].clear()
+            self._emails[user_base].clear()
+            self._fetching.add(user_base)
+            thread = threading.Thread(target=self._fetch, name='FreeIPADirectory-%s' % user_base,
+                                      args=(user_base, self._containers[user_base] + base_dn, pages, cancel))
+            thread.daemon = True
+            thread.start()
+
+        try:
+            running = len(pending)
+            while running:
+                user_base, page, error = pages.get()
+                if error is not None:
+                    raise error
+                if page is None:
+                    running -= 1
+                    self._fetching.discard(user_base)
+                    self._loaded.add(user_base)
+                    log.debug('%s users: %s' % (user_base.capitalize(), len(self._users[user_base])))
+                    continue
+                for dn, attrs in page:
+                    if dn is None or not attrs.get('uid'):
+                        continue
+                    added = self._add_user(user_base, dn, attrs)
+                    if added:
+                        yield (user_base,) + added
+        finally:
+            cancel.set()
+            self._fetching.difference_update(pending)
+
+    def load(self, user_bases=('active', 'stage', 'preserved')):
+        """Fetch given containers concurrently"""
+        for _ in self.stream(user_bases):
+            pass
+
+    def _ensure(self, user_base):
+        """Fetch container unless it is loaded or already being fetched"""
+        if user_base not in self._loaded and user_base not in self._fetching:
+            self.load((user_base,))
+
+    def users(self, user_base='active'):
+        """Return dict of users"""
+        self._ensure(user_base)
+        return self._users[user_base]
+
+    def find_users_by_email(self, email, user_base='active'):
+        """Return list of users with given email address"""
+        self._ensure(user_base)
+        users = list(self._emails[user_base].get(str(email).lower(), []))
+        log.debug('%s users with email address %s: %s' % (user_base.capitalize(), email, len(users)))
+        return users
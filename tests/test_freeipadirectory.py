@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+from bamboo_ipa_sync.freeipadirectory import FreeIPADirectory
+
+BASE_DN = 'dc=ipa,dc=example,dc=com'
+
+
+class FakeConnection(object):
+    """Stub LDAP connection serving containers as lists of pages"""
+    def __init__(self, containers, fail=None, searches=None):
+        self._containers = containers
+        self._fail = fail
+        self._searches = searches if searches is not None else []
+        self._results = {}
+        self.unbound = False
+
+    def unbind_s(self):
+        self.unbound = True
+
+    def search_s(self, base, scope, fltr, attrs=None):
+        return [('cn=config', {'nsslapd-defaultnamingcontext': [BASE_DN.encode('utf-8')]})]
+
+    def search_ext(self, base, scope, fltr, attrs=None, serverctrls=None):
+        if self._fail and base.startswith(self._fail):
+            raise ldap.SERVER_DOWN({'desc': "Can't contact LDAP server"})
+        pages = self._containers.get(base.partition(',')[0], [])
+        page = int(serverctrls[0].cookie or 0)
+        if not page:
+            self._searches.append(base.partition(',')[0])
+        cookie = str(page + 1) if page + 1 < len(pages) else ''
+        msgid = len(self._results) + 1
+        self._results[msgid] = (pages[page] if pages else [], cookie)
+        return msgid
+
+    def result3(self, msgid):
+        rdata, cookie = self._results.pop(msgid)
+        return ldap.RES_SEARCH_RESULT, rdata, msgid, [SimplePagedResultsControl(True, size=0, cookie=cookie)]
+
+
+class FakeDirectory(FreeIPADirectory):
+    """FreeIPADirectory handing out stub connections"""
+    def __init__(self, containers, fail=None, connect_error=None):
+        FreeIPADirectory.__init__(self, 'ipa.example.com', page_size=2)
+        self._fake_containers = containers
+        self._fail = fail
+        self._connect_error = connect_error
+        self.connects = 0
+        self.searches = []
+        self.connections = []
+
+    def _connect(self):
+        self.connects += 1
+        if self._connect_error:
+            raise self._connect_error
+        conn = FakeConnection(self._fake_containers, self._fail, self.searches)
+        self.connections.append(conn)
+        return conn
+
+
+def entry(uid, *mail):
+    attrs = {'uid': [uid.encode('utf-8')], 'mail': [m.encode('utf-8') for m in mail]}
+    return 'uid=%s,cn=users,cn=accounts,%s' % (uid, BASE_DN), attrs
+
+
+def workers_alive(timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        alive = [t for t in threading.enumerate() if t.name.startswith('FreeIPADirectory-')]
+        if not alive:
+            break
+        time.sleep(0.05)
+    return alive
+
+
+class FreeIPADirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.containers = {
+            'cn=users': [
+                [entry('alice', 'Alice@Example.com'), entry('bob', 'bob@example.com')],
+                [entry('carol', 'carol@example.com'), entry('dave')],
+                [entry('erin', 'erin@example.com')]
+            ]
+        }
+
+    def test_pages_followed_by_empty_cookie(self):
+        directory = FakeDirectory(self.containers)
+        uids = [uid for _, uid, _ in directory.stream()]
+        self.assertEqual(uids, ['alice', 'bob', 'carol', 'dave', 'erin'])
+        self.assertEqual(sorted(directory.users()), uids)
+        self.assertEqual(directory.connects, 1)
+
+    def test_empty_container_marked_as_loaded(self):
+        directory = FakeDirectory(self.containers)
+        directory.load()
+        self.assertEqual(directory.users('stage'), {})
+        self.assertEqual(directory.users('preserved'), {})
+        self.assertEqual(len(directory.users()), 5)
+        connects = directory.connects
+        self.assertEqual(directory.users('stage'), {})
+        self.assertEqual(list(directory.stream(('stage',))), [])
+        self.assertEqual(directory.connects, connects)
+
+    def test_search_failure_raises(self):
+        directory = FakeDirectory(self.containers, fail='cn=staged users')
+        self.assertRaises(ldap.SERVER_DOWN, directory.load)
+
+    def test_connect_failure_raises(self):
+        directory = FakeDirectory(self.containers, connect_error=ldap.INVALID_CREDENTIALS({'desc': 'Invalid'}))
+        directory._base_dn = BASE_DN
+        self.assertRaises(ldap.INVALID_CREDENTIALS, directory.load)
+
+    def test_lookup_during_stream_does_not_refetch(self):
+        directory = FakeDirectory(self.containers)
+        for _, uid, user in directory.stream():
+            self.assertIs(directory.users()[uid], user)
+            directory.find_users_by_email('erin@example.com')
+        self.assertEqual(directory.searches, ['cn=users'])
+        for mail in ['alice@example.com', 'bob@example.com', 'carol@example.com', 'erin@example.com']:
+            self.assertEqual(len(directory.find_users_by_email(mail)), 1)
+        self.assertEqual(directory.searches, ['cn=users'])
+
+    def test_abandoned_stream_stops_workers(self):
+        self.containers['cn=users'] = [[entry('user%d%d' % (p, i)) for i in range(2)] for p in range(50)]
+        directory = FakeDirectory(self.containers)
+        stream = directory.stream()
+        next(stream)
+        stream.close()
+        self.assertEqual(workers_alive(), [])
+        self.assertTrue(all(conn.unbound for conn in directory.connections))
+        self.assertEqual(len(directory.users()), 100)
+
+    def test_failure_stops_other_workers(self):
+        self.containers['cn=users'] = [[entry('user%d%d' % (p, i)) for i in range(2)] for p in range(50)]
+        directory = FakeDirectory(self.containers, fail='cn=staged users')
+        self.assertRaises(ldap.SERVER_DOWN, directory.load)
+        self.assertEqual(workers_alive(), [])
+
+    def test_find_users_by_email_ignores_case(self):
+        directory = FakeDirectory(self.containers)
+        users = directory.find_users_by_email('alice@EXAMPLE.COM')
+        self.assertEqual([user.uid for user in users], ['alice'])
+        self.assertEqual(directory.find_users_by_email('nobody@example.com'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()